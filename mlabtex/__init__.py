@@ -13,15 +13,49 @@ The following functions are provided:
 
    render_latex
    mlabtex
+   mlabtex_sequence
    mlabimg
 
+Render cache
+------------
+Rendered images are cached on disk to not render the same text twice.
+
+.. autosummary::
+
+   RenderCache
+   render_many
+   CACHE
+
+Label culling
+-------------
+Labels off-screen or smaller than a pixel can be hidden automatically.
+
+.. autosummary::
+
+   label_manager
+   LabelManager
+
+Command line
+------------
+Formulas can be rendered to image files without mayavi with::
+
+    python -m mlabtex render manifest.jsonl
+
+See ``mlabtex.cli`` for the manifest format.
+
 ---
 """
 from __future__ import absolute_import
 
 from mlabtex._version import __version__
 from mlabtex.core import mlabtex, render_latex, mlabimg
+from mlabtex.core import mlabtex_sequence, TextureSequence
+from mlabtex.cache import RenderCache, render_many, CACHE
+from mlabtex.labels import LabelManager, label_manager
 
 
 __all__ = ["mlabtex", "render_latex", "mlabimg"]
+__all__ += ["mlabtex_sequence", "TextureSequence"]
+__all__ += ["RenderCache", "render_many", "CACHE"]
+__all__ += ["LabelManager", "label_manager"]
 __all__ += ["__version__"]
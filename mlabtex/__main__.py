@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""mlabtex: Entry point for ``python -m mlabtex``."""
+import sys
+
+from mlabtex.cli import main
+
+sys.exit(main())
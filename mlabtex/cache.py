@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+"""mlabtex: A file based cache for rendered latex images."""
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+from mlabtex.render import reference_height, render_latex
+
+# os.replace is atomic on all platforms, but only available in python 3
+_replace = getattr(os, "replace", os.rename)
+# names of the cache entries: a sha1 hex digest with an extension
+_ENTRY = re.compile(r"^[0-9a-f]{40}\.[0-9a-z]+$")
+
+
+def default_cache_dir():
+    """
+    Default directory of the render cache.
+
+    It is given by the environment variable ``MLABTEX_CACHE_DIR``
+    or ``~/.cache/mlabtex`` if that is not set.
+    """
+    return os.environ.get(
+        "MLABTEX_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "mlabtex"),
+    )
+
+
+class RenderCache(object):
+    """
+    A file based cache for rendered latex images.
+
+    Every rendered image is stored under a hash of its render parameters,
+    so the same text is never rendered twice.
+
+    Attributes
+    ----------
+    directory : string
+        Path to the cache directory.
+    history : OrderedDict
+        Render parameters of all texts rendered with this cache in the
+        current run, that can be saved with :any:`save_history` to
+        prewarm the cache with :any:`prewarm` on the next start.
+    """
+
+    def __init__(self, directory=None):
+        """
+        A file based cache for rendered latex images.
+
+        Parameter
+        ---------
+        directory : string, optional
+            The cache directory. It is created on the first render.
+            If set to ``None``, :any:`default_cache_dir` is used.
+            Default: None
+        """
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.history = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(
+        self, text, color=(0, 0, 0), dpi=600, output="png", backend=None
+    ):
+        """Unique key for the given render parameters."""
+        params = [text, [float(c) for c in color], int(dpi), output, backend]
+        return hashlib.sha1(json.dumps(params).encode("utf-8")).hexdigest()
+
+    def file(
+        self, text, color=(0, 0, 0), dpi=600, output="png", backend=None
+    ):
+        """Path to the cached image for the given render parameters."""
+        key = self.key(text, color, dpi, output, backend)
+        return os.path.join(self.directory, key + "." + output)
+
+    def contains(
+        self, text, color=(0, 0, 0), dpi=600, output="png", backend=None
+    ):
+        """Whether the given render parameters are already cached."""
+        return os.path.isfile(self.file(text, color, dpi, output, backend))
+
+    def info(
+        self, text, color=(0, 0, 0), dpi=600, output="png", backend=None
+    ):
+        """
+        Information about a cached image.
+
+        Returns
+        -------
+        info : dict
+            The render parameters ``"text"``, ``"color"``, ``"dpi"``,
+            ``"output"`` and ``"backend"`` of the cached image,
+            where ``"backend"`` is the backend that rendered it, and the
+            ``"reference_height"`` of the letter "I" for this backend.
+        """
+        cached = self.file(text, color, dpi, output, backend)
+        with open(os.path.splitext(cached)[0] + ".json", "r") as info:
+            return json.load(info)
+
+    def reference_height(
+        self, text, color=(0, 0, 0), dpi=600, output="png", backend=None
+    ):
+        """
+        Height of the letter "I" in pixels for a cached image.
+
+        It is stored with the image on the host that rendered it, so images
+        imported from a bundle are scaled the same way without latex.
+        See :any:`reference_height`.
+        """
+        info = self.info(text, color, dpi, output, backend)
+        if "reference_height" in info:
+            return info["reference_height"]
+        # entries of older versions
+        return reference_height(info["backend"], dpi)
+
+    def render(
+        self,
+        text,
+        path=None,
+        color=(0, 0, 0),
+        dpi=600,
+        output="png",
+        backend=None,
+        record=True,
+    ):
+        """
+        Renders LaTeX-formula into an image, if it is not cached yet.
+
+        Parameters
+        ----------
+        text : string
+            String containing the latex-code.
+        path : string, optional
+            Path to a file, the image should be copied to.
+            If set to ``None``, only the cache is filled. Default: None
+        color : tuple, optional
+            color of the text given as rgb tuple. Default: ``(0, 0, 0)``
+        dpi : int, optional
+            Used dpi. Default: 600
+        output : string, optional
+            Output format. Default: ``"png"``
+        backend : string, optional
+            The backend to use. If set to ``None``, all backends are tried.
+            Default: None
+        record : bool, optional
+            Whether to record the render parameters in the :any:`history`.
+            Default: True
+
+        Returns
+        -------
+        cached : string
+            Path to the cached image.
+        """
+        key = self.key(text, color, dpi, output, backend)
+        cached = os.path.join(self.directory, key + "." + output)
+        if record:
+            params = {
+                "text": text,
+                "color": [float(c) for c in color],
+                "dpi": int(dpi),
+                "output": output,
+                "backend": backend,
+            }
+            # the cache might be prewarmed in a background thread
+            with self._lock:
+                self.history[key] = params
+        if not os.path.isfile(cached):
+            self._makedirs()
+            # render next to the cache entry and move it there afterwards,
+            # so concurrent processes never see incomplete images
+            fd, tmp = tempfile.mkstemp(
+                suffix="." + output, dir=self.directory
+            )
+            os.close(fd)
+            try:
+                used = render_latex(text, tmp, color, dpi, output, backend)
+                info = {
+                    "text": text,
+                    "color": [float(c) for c in color],
+                    "dpi": int(dpi),
+                    "output": output,
+                    "backend": used,
+                    "reference_height": reference_height(used, dpi),
+                }
+                # the info is written first, so it exists for every image
+                self._write(key + ".json", json.dumps(info).encode("utf-8"))
+                _replace(tmp, cached)
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+        if path is not None:
+            shutil.copyfile(cached, path)
+        return cached
+
+    def save_history(self, path):
+        """
+        Save the render parameters of the current run as manifest.
+
+        Parameters
+        ----------
+        path : string
+            Path to the JSON-lines manifest file.
+        """
+        with self._lock:
+            history = list(self.history.values())
+        with open(path, "w") as manifest:
+            for params in history:
+                manifest.write(json.dumps(params) + "\n")
+
+    def prewarm(self, manifest, processes=None, background=True):
+        """
+        Render all texts of a manifest into the cache.
+
+        The texts are not recorded in the :any:`history`.
+
+        Parameters
+        ----------
+        manifest : string
+            Path to a JSON-lines manifest file, e.g. from
+            :any:`save_history`. Paths of the records are ignored.
+        processes : int, optional
+            Number of worker processes. If set to ``None``, the number of
+            CPUs is used. Default: None
+        background : bool, optional
+            Whether to render in a background thread. Default: True
+
+        Returns
+        -------
+        result : threading.Thread or list
+            The started thread if rendering in the background,
+            the results of :any:`render_many` otherwise.
+        """
+
+        def run():
+            with open(manifest, "r") as lines:
+                records = (
+                    dict(record, path=None)
+                    for _, record, _ in read_manifest(lines)
+                    if record is not None
+                )
+                return list(render_many(records, self, processes))
+
+        if not background:
+            return run()
+        thread = threading.Thread(target=run, name="mlabtex-prewarm")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def export_bundle(self, path, manifest=None):
+        """
+        Export cached images into a single bundle file.
+
+        The bundle can be imported with :any:`import_bundle` on hosts
+        without a latex installation.
+
+        Parameters
+        ----------
+        path : string
+            Path to the bundle file (a zip archive).
+        manifest : string, optional
+            Path to a JSON-lines manifest file to only export its records.
+            If set to ``None``, all cached images are exported.
+            Default: None
+
+        Returns
+        -------
+        count : int
+            Number of exported images.
+        """
+        if manifest is None:
+            keys = [
+                name[:-5]
+                for name in sorted(_listdir(self.directory))
+                if _ENTRY.match(name) and name.endswith(".json")
+            ]
+        else:
+            with open(manifest, "r") as lines:
+                keys = [
+                    self.key(
+                        record["text"],
+                        record["color"],
+                        record["dpi"],
+                        record["output"],
+                        record["backend"],
+                    )
+                    for _, record, _ in read_manifest(lines)
+                    if record is not None
+                ]
+        count = 0
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as bundle:
+            for key in OrderedDict.fromkeys(keys):
+                info = os.path.join(self.directory, key + ".json")
+                if not os.path.isfile(info):
+                    continue
+                with open(info, "r") as fil:
+                    image = key + "." + json.load(fil)["output"]
+                if not os.path.isfile(os.path.join(self.directory, image)):
+                    continue
+                # images are already compressed
+                bundle.write(info, key + ".json")
+                bundle.write(
+                    os.path.join(self.directory, image),
+                    image,
+                    compress_type=zipfile.ZIP_STORED,
+                )
+                count += 1
+        return count
+
+    def import_bundle(self, path):
+        """
+        Import cached images from a bundle file.
+
+        Parameters
+        ----------
+        path : string
+            Path to the bundle file created by :any:`export_bundle`.
+
+        Returns
+        -------
+        count : int
+            Number of imported images.
+        """
+        self._makedirs()
+        count = 0
+        with zipfile.ZipFile(path, "r") as bundle:
+            names = [n for n in bundle.namelist() if _ENTRY.match(n)]
+            # info files first, so they exist for every image
+            for name in sorted(names, key=lambda n: not n.endswith(".json")):
+                self._write(name, bundle.read(name))
+                count += not name.endswith(".json")
+        return count
+
+    def _write(self, name, data):
+        """Write a file into the cache atomically."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as fil:
+                fil.write(data)
+            _replace(tmp, os.path.join(self.directory, name))
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _makedirs(self):
+        """Create the cache directory if needed."""
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # created by a concurrent process
+                if not os.path.isdir(self.directory):
+                    raise
+
+
+CACHE = RenderCache()
+"""RenderCache: The default render cache used by mlabtex."""
+
+
+def _listdir(directory):
+    """List a directory, that might not exist."""
+    return os.listdir(directory) if os.path.isdir(directory) else []
+
+
+def read_manifest(lines):
+    """
+    Read render records from the lines of a manifest.
+
+    Parameters
+    ----------
+    lines : iterable of string
+        JSON encoded records. Empty lines are skipped.
+        Only ``"text"`` is required. Without ``"path"``, the record only
+        fills the cache. The output format is determined by the extension
+        of ``"path"``, if ``"output"`` is not given (``"png"`` by default).
+
+    Yields
+    ------
+    number : int
+        Line number of the record (starting at 1).
+    record : dict or None
+        The render record. None if the line is invalid.
+    error : string or None
+        The error message, if the line is invalid.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise TypeError("record is not an object: " + repr(data))
+            path = data.get("path")
+            output = data.get("output")
+            if output is None and path is not None:
+                output = os.path.splitext(path)[1][1:].lower()
+            output = output or "png"
+            record = {
+                "text": data["text"],
+                "path": path,
+                "color": _color(data.get("color", (0, 0, 0))),
+                "dpi": int(data.get("dpi", 600)),
+                "output": output,
+                "backend": data.get("backend"),
+            }
+        except (ValueError, TypeError, KeyError) as exc:
+            yield number, None, "invalid record: " + repr(exc)
+        else:
+            yield number, record, None
+
+
+def _color(color):
+    """Convert a color to a tuple of three floats."""
+    color = tuple(float(c) for c in color)
+    if len(color) != 3:
+        raise ValueError("color needs 3 values: " + repr(color))
+    return color
+
+
+def _render_record(args):
+    """Render a single record in a worker process."""
+    index, record, directory = args
+    try:
+        if directory is None:
+            render_latex(
+                record["text"],
+                record["path"],
+                record["color"],
+                record["dpi"],
+                record["output"],
+                record.get("backend"),
+            )
+        else:
+            RenderCache(directory).render(record=False, **record)
+    except Exception as exc:
+        return index, "failed", str(exc)
+    return index, "rendered", None
+
+
+def render_many(records, cache=CACHE, processes=None):
+    """
+    Render a stream of LaTeX-formulas with a pool of worker processes.
+
+    Parameters
+    ----------
+    records : iterable of dict
+        Render parameters with the keys ``"text"``, ``"path"``,
+        ``"color"``, ``"dpi"``, ``"output"`` and optionally ``"backend"``.
+        ``"path"`` can be ``None`` to only fill the cache.
+    cache : RenderCache or None, optional
+        The cache to use. Records already present in the cache are only
+        copied to their path and not rendered again.
+        If set to ``None``, every record is rendered to its path.
+        Default: :any:`CACHE`
+    processes : int, optional
+        Number of worker processes. If set to ``None``, the number of CPUs
+        is used. If set to 1, the records are rendered in the current
+        process. Default: None
+
+    Yields
+    ------
+    index : int
+        Position of the record in the given stream.
+    status : string
+        Either ``"cached"``, ``"rendered"`` or ``"failed"``.
+    error : string or None
+        The error message, if the rendering failed.
+
+    Notes
+    -----
+    The results are yielded as soon as they are ready,
+    so they are not ordered like the given records.
+
+    The worker processes are only started, if a record is not cached.
+    Where processes are spawned (the default on Windows and macOS),
+    the calling script needs an ``if __name__ == "__main__":`` guard.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    directory = None if cache is None else cache.directory
+    results = queue.Queue()
+    pending = 0
+    # the pool is only started, if anything needs to be rendered
+    pool = None
+    try:
+        for index, record in enumerate(records):
+            if cache is not None and cache.contains(
+                record["text"],
+                record["color"],
+                record["dpi"],
+                record["output"],
+                record.get("backend"),
+            ):
+                try:
+                    cache.render(record=False, **record)
+                except Exception as exc:
+                    yield index, "failed", str(exc)
+                else:
+                    yield index, "cached", None
+                continue
+            if processes == 1:
+                # no worker process needed
+                yield _render_record((index, record, directory))
+                continue
+            if pool is None:
+                pool = multiprocessing.Pool(processes)
+            kwargs = {}
+            if sys.version_info[0] > 2:
+                # lost tasks (e.g. unpicklable records) are reported as failed
+                kwargs["error_callback"] = _failed(results, index)
+            pool.apply_async(
+                _render_record,
+                ((index, record, directory),),
+                callback=results.put,
+                **kwargs
+            )
+            pending += 1
+            # limit the records in flight to keep memory bounded
+            while pending >= 4 * processes or not results.empty():
+                pending -= 1
+                yield results.get()
+        while pending:
+            pending -= 1
+            yield results.get()
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        # let the workers exit normally to clean up their latex directories
+        pool.close()
+        pool.join()
+
+
+def _failed(results, index):
+    """Error callback putting a failed result for the given record."""
+
+    def callback(exc):
+        results.put((index, "failed", str(exc)))
+
+    return callback
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+mlabtex: Command line interface to render latex code into image files.
+
+Usage::
+
+    python -m mlabtex render manifest.jsonl
+    python -m mlabtex export bundle.zip [--manifest manifest.jsonl]
+    python -m mlabtex import bundle.zip
+
+The manifest is a JSON-lines file with one record per line, e.g.::
+
+    {"text": "$\\alpha$", "path": "alpha.png", "color": [1, 0, 0], "dpi": 600}
+
+Only ``"text"`` is required. Records without ``"path"`` only fill the
+render cache. The output format is determined by the extension of
+``"path"``, if ``"output"`` is not given.
+A ``"backend"`` (``"native"``, ``"sympy"`` or ``"mpl"``) can be given.
+Mayavi is not needed for this.
+
+Bundles hold cached images to be imported on hosts without latex.
+"""
+from __future__ import absolute_import, division, print_function
+
+import sys
+import json
+import argparse
+
+from mlabtex.cache import RenderCache, read_manifest, render_many
+
+
+def render(args):
+    """Render all records of a manifest."""
+    cache = None if args.no_cache else RenderCache(args.cache_dir)
+    report = sys.stdout if args.report == "-" else open(args.report, "w")
+    counts = {"rendered": 0, "cached": 0, "failed": 0}
+    numbers, paths = [], {}
+
+    def write(number, path, status, error):
+        counts[status] += 1
+        result = {"line": number, "path": path, "status": status}
+        if error is not None:
+            result["error"] = error
+        report.write(json.dumps(result) + "\n")
+        report.flush()
+        if not args.quiet or status == "failed":
+            name = "line {}".format(number) if path is None else path
+            print(
+                "[{}] {}: {}".format(sum(counts.values()), status, name),
+                file=sys.stderr,
+            )
+            if error is not None:
+                print(error, file=sys.stderr)
+
+    def valid(manifest):
+        # invalid lines are reported directly without stopping the stream
+        for number, record, error in read_manifest(manifest):
+            if record is not None and cache is None and not record["path"]:
+                record, error = None, "no path given without cache"
+            if record is None:
+                write(number, None, "failed", error)
+                continue
+            paths[len(numbers)] = record["path"]
+            numbers.append(number)
+            yield record
+
+    with open(args.manifest, "r") as manifest:
+        try:
+            results = render_many(valid(manifest), cache, args.processes)
+            for index, status, error in results:
+                write(numbers[index], paths.pop(index), status, error)
+        finally:
+            if report is not sys.stdout:
+                report.close()
+    print(
+        "{rendered} rendered, {cached} cached, {failed} failed".format(
+            **counts
+        ),
+        file=sys.stderr,
+    )
+    return 1 if counts["failed"] else 0
+
+
+def export(args):
+    """Export cached images into a bundle."""
+    count = RenderCache(args.cache_dir).export_bundle(
+        args.bundle, args.manifest
+    )
+    print("{} images exported".format(count), file=sys.stderr)
+    return 0
+
+
+def import_(args):
+    """Import cached images from a bundle."""
+    count = RenderCache(args.cache_dir).import_bundle(args.bundle)
+    print("{} images imported".format(count), file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    """
+    Command line entry point of mlabtex.
+
+    Parameters
+    ----------
+    argv : list of string, optional
+        The command line arguments. If set to ``None``, ``sys.argv`` is used.
+        Default: None
+
+    Returns
+    -------
+    code : int
+        The exit code. 1 if any record failed to render.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mlabtex", description="Render latex code into image files."
+    )
+    commands = parser.add_subparsers(dest="command")
+    cache_help = (
+        "render cache directory (default: $MLABTEX_CACHE_DIR "
+        "or ~/.cache/mlabtex)"
+    )
+    cmd = commands.add_parser(
+        "render", help="render all records of a JSON-lines manifest"
+    )
+    cmd.add_argument("manifest", help="path to the manifest file")
+    cmd.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        default=None,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    cmd.add_argument("--cache-dir", default=None, help=cache_help)
+    cmd.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="render every record without using the cache",
+    )
+    cmd.add_argument(
+        "-r",
+        "--report",
+        default="-",
+        help="JSON-lines report file of all records (default: stdout)",
+    )
+    cmd.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="only print failed records to stderr",
+    )
+    cmd.set_defaults(func=render)
+    cmd = commands.add_parser(
+        "export", help="export cached images into a bundle file"
+    )
+    cmd.add_argument("bundle", help="path to the bundle file")
+    cmd.add_argument(
+        "-m",
+        "--manifest",
+        default=None,
+        help="only export the records of this manifest (default: all)",
+    )
+    cmd.add_argument("--cache-dir", default=None, help=cache_help)
+    cmd.set_defaults(func=export)
+    cmd = commands.add_parser(
+        "import", help="import cached images from a bundle file"
+    )
+    cmd.add_argument("bundle", help="path to the bundle file")
+    cmd.add_argument("--cache-dir", default=None, help=cache_help)
+    cmd.set_defaults(func=import_)
+    args = parser.parse_args(argv)
+    if getattr(args, "func", None) is None:
+        parser.print_help()
+        return 2
+    return args.func(args)
@@ -2,252 +2,203 @@
 """mlabtex: A latex renderer for mayavi."""
 from __future__ import absolute_import, division, print_function
 
+import io
 import os
+import shutil
 import tempfile
+import multiprocessing
 import numpy as np
-from mayavi import mlab
-from tvtk.api import tvtk
 
-# all supported image formates by tvtk
+from mlabtex.render import (  # noqa: F401
+    RenderError,
+    TmpFile,
+    render_latex,
+    render_latex_data,
+    render_latex_mpl,
+    render_latex_native,
+    render_latex_sympy,
+    reference_height,
+)
+from mlabtex.cache import CACHE, RenderCache, render_many
+from mlabtex.labels import label_manager
+
+# all supported image formates by tvtk (reader class names)
 IMREAD = {
-    "bmp": tvtk.BMPReader,
-    "jpg": tvtk.JPEGReader,
-    "jpeg": tvtk.JPEGReader,
-    "png": tvtk.PNGReader,
-    "pnm": tvtk.PNMReader,
-    "dcm": tvtk.DICOMImageReader,
-    "tiff": tvtk.TIFFReader,
-    "ximg": tvtk.GESignaReader,
-    "dem": tvtk.DEMReader,
-    "mha": tvtk.MetaImageReader,
-    "mhd": tvtk.MetaImageReader,
-    "mnc": tvtk.MINCImageReader,
+    "bmp": "BMPReader",
+    "jpg": "JPEGReader",
+    "jpeg": "JPEGReader",
+    "png": "PNGReader",
+    "pnm": "PNMReader",
+    "dcm": "DICOMImageReader",
+    "tiff": "TIFFReader",
+    "ximg": "GESignaReader",
+    "dem": "DEMReader",
+    "mha": "MetaImageReader",
+    "mhd": "MetaImageReader",
+    "mnc": "MINCImageReader",
 }
 
 
-class RenderError(Exception):
-    """Render error."""
+# magic numbers of image formats to detect the type of image data
+MAGIC = [
+    (b"\x89PNG", "png"),
+    (b"\xff\xd8", "jpg"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+]
+# image formats, that tvtk can read from memory
+MEMREAD = ["png", "jpg", "jpeg"]
 
-    pass
+try:
+    _STRING_TYPES = basestring  # noqa: F821
+except NameError:  # python 3
+    _STRING_TYPES = str
 
 
-class TmpFile(object):
+def image_type(image):
     """
-    A closed temporary file class.
-
-    Attributes
-    ----------
-    name : string
-        Name and path to the file.
-    file : class
-        Temporary file handler
-    """
-
-    def __init__(self, suffix="txt"):
-        """
-        A closed temporary file.
-
-        Parameter
-        ---------
-        suffix : string, optional
-            The suffix for the temporary file. Default: "txt"
-        """
-        self.file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
-        self.file.close()
-
-    @property
-    def name(self):
-        """File name."""
-        return self.file.name
-
-    def close(self):
-        """Unlink the file."""
-        os.unlink(self.name)
-
-
-def render_latex_mpl(text, path, color=(0, 0, 0), dpi=600, output="png"):
-    r"""
-    Render a LaTeX-formula into an image with matplotlib.
+    Determine the type of an image.
 
     Parameters
     ----------
-    text : string
-        String containing the latex-code.
-    path : string
-        Path to the file to be saved.
-    color : tuple, optional
-        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
-    dpi : int, optional
-        Used dpi. Default: 1200
-    output : string, optional
-        Output format. Default: ``"png"``
+    image : string, bytes, file-like or numpy.ndarray
+        Path to the image file, the image data, a binary file-like object
+        with the image data or an array of pixels.
 
-    Notes
-    -----
-    If you get the following error:
-
-        ``RuntimeError: libpng signaled error``
-
-    Try to set the dpi higher. (1200 recomended)
-
-    If big symbols like ``\int`` or ``\sum`` don't show up properly,
-    try setting a
-
-        ``\displaystyle``
-
-    infront of them.
+    Returns
+    -------
+    typ : string
+        The image type. See :any:`IMREAD`.
+        ``"array"`` for arrays and objects convertible to arrays.
     """
-    from matplotlib.mathtext import MathTextParser
-    from matplotlib.font_manager import FontProperties
-    from matplotlib import figure, rc
-
-    # backend_agg supports all of the core output formats
-    from matplotlib.backends import backend_agg
-
-    rc("text", usetex=False)
-    prop = FontProperties()
-    parser = MathTextParser("path")
-    width, height, depth, _, _ = parser.parse(text, dpi=72, prop=prop)
-    fig = figure.Figure(figsize=(width / 72.0, height / 72.0))
-    fig.text(0, depth / height, text, fontproperties=prop, color=color)
-    backend_agg.FigureCanvasAgg(fig)
-    fig.savefig(path, dpi=dpi, format=output, transparent=True)
-
-
-def render_latex_sympy(text, path, color=(0, 0, 0), dpi=600, output="png"):
-    r"""
-    Renders LaTeX-formula into an image with sympy.
-
-    Parameters
-    ----------
-    text : string
-        String containing the latex-code.
-    path : string
-        Path to the file to be saved.
-    color : tuple, optional
-        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
-    dpi : int, optional
-        Used dpi. Default: 1200
-    output : string, optional
-        Output format. Default: ``"png"``
-
-    Notes
-    -----
-    If you get the following error:
-
-        ``RuntimeError: libpng signaled error``
-
-    Try to set the dpi higher. (1200 recomended)
-
-    If big symbols like ``\int`` or ``\sum`` don't show up properly,
-    try setting a
-
-        ``\displaystyle``
-
-    infront of them.
+    data = _data(image)
+    if data is not None:
+        return _data_type(data)
+    if isinstance(image, np.ndarray) or hasattr(image, "__array_interface__"):
+        return "array"
+    return os.path.splitext(image)[1][1:].lower()
+
+
+def _data(image):
+    """Image data of bytes or file-like objects. None for paths or arrays."""
+    # paths first, since strings are bytes in python 2
+    if isinstance(image, _STRING_TYPES):
+        return None
+    if hasattr(image, "read"):
+        return _read(image)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(bytearray(image))
+    return None
+
+
+def _data_type(data):
+    """Determine the type of image data by its magic number."""
+    for magic, typ in MAGIC:
+        if data.startswith(magic):
+            return typ
+    raise ValueError("The image data type could not be determined.")
+
+
+def _read(fileobj):
+    """Read all data from a file-like object without moving its position."""
+    pos = fileobj.tell() if hasattr(fileobj, "tell") else None
+    data = fileobj.read()
+    if pos is not None:
+        fileobj.seek(pos)
+    if not isinstance(data, bytes):
+        raise TypeError("The image file needs to be opened in binary mode.")
+    return data
+
+
+def load_texture(path, typ=None):
     """
-    from sympy import preview
-
-    preamble = (
-        r"\documentclass[12pt]{article}"
-        + os.linesep
-        + r"\pagestyle{empty}"
-        + os.linesep
-        + r"\usepackage[utf8]{inputenc}"
-        + os.linesep
-        + r"\usepackage{amsmath}"
-        + os.linesep
-        + r"\usepackage{amssymb}"
-        + os.linesep
-        + r"\usepackage{amsfonts}"
-        + os.linesep
-        + r"\usepackage{helvet}"
-        + os.linesep
-        + r"\renewcommand{\familydefault}{\sfdefault}"
-        + os.linesep
-        + r"\usepackage{xcolor}"
-        + os.linesep
-        + r"\definecolor{user}{rgb}"
-        + "{"
-        + "{}, {}, {}".format(*color)
-        + "}"
-        + os.linesep
-        + r"\color{user}"
-        + os.linesep
-        + r"\everymath{\displaystyle}"
-        + os.linesep
-        + r"\begin{document}"
-    )
-    preview(
-        text,
-        viewer="file",
-        output=output,
-        filename=path,
-        preamble=preamble,
-        euler=False,
-        dvioptions=[
-            "-T",
-            "tight",
-            "-z",
-            "0",
-            "--truecolor",
-            "-D",
-            str(int(dpi)),
-            "-bg",
-            "Transparent",
-        ],
-    )
-
-
-def render_latex(text, path, color=(0, 0, 0), dpi=600, output="png"):
-    r"""
-    Renders LaTeX-formula into an image.
+    Load an image as texture.
 
     Parameters
     ----------
-    text : string
-        String containing the latex-code.
-    path : string
-        Path to the file to be saved.
-    color : tuple, optional
-        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
-    dpi : int, optional
-        Used dpi. Default: 1200
-    output : string, optional
-        Output format. Default: ``"png"``
-
-    Notes
-    -----
-    If you get the following error:
-
-        ``RuntimeError: libpng signaled error``
-
-    Try to set the dpi higher. (1200 recomended)
-
-    If big symbols like ``\int`` or ``\sum`` don't show up properly,
-    try setting a
-
-        ``\displaystyle``
-
-    infront of them.
+    path : string, bytes, file-like or numpy.ndarray
+        Path to the image file, the image data, a binary file-like object
+        with the image data or an array of pixels.
+        Arrays have the shape (height, width) for gray scale images or
+        (height, width, 3 or 4) for RGB(A) images and the first row is the
+        top of the image. Integers are taken as 8 bit values,
+        floats are scaled from [0, 1].
+        Objects like PIL images are converted to arrays.
+    typ : string, optional
+        The image type. See :any:`IMREAD`.
+        If set to ``None``, it is determined by :any:`image_type`.
+        Default: None
 
-    It will try to render it with sympy first.
-    If that fails it will use matplotlib.
+    Returns
+    -------
+    texture : tvtk.Texture
+        The texture holding the image.
+    extent : tuple
+        The maximal x and y index of the image.
     """
-    try:
-        render_latex_sympy(text, path, color, dpi, output)
-    except Exception as exc_1:
+    from tvtk.api import tvtk
+
+    buffer = _data(path)
+    if typ is None:
+        typ = image_type(path) if buffer is None else _data_type(buffer)
+    if typ == "array":
+        data = _image_data(path)
+    elif buffer is not None and typ not in MEMREAD:
+        # formats without support for memory buffers need a file
+        tmp = TmpFile(suffix="." + typ)
         try:
-            render_latex_mpl(text, path, color, dpi, output)
-        except Exception as exc_2:
-            raise RenderError(
-                "Mlabtex: Could not render the latex-code..."
-                + os.linesep
-                + str(exc_1)
-                + os.linesep
-                + str(exc_2)
-                + os.linesep
-            )
+            with open(tmp.name, "wb") as fil:
+                fil.write(buffer)
+            img = getattr(tvtk, IMREAD[typ])()
+            img.file_name = tmp.name
+            img.update()
+            data = tvtk.ImageData()
+            data.deep_copy(img.output)
+        finally:
+            tmp.close()
+    elif buffer is not None:
+        img = getattr(tvtk, IMREAD[typ])()
+        img.memory_buffer = buffer
+        img.memory_buffer_length = len(buffer)
+        img.update()
+        # copy the image, since the reader doesn't own the memory buffer
+        data = tvtk.ImageData()
+        data.deep_copy(img.output)
+    else:
+        img = getattr(tvtk, IMREAD[typ])()
+        img.file_name = path
+        img.update()
+        # create the texture from the image
+        texture = tvtk.Texture(
+            input_connection=img.output_port, interpolate=0
+        )
+        return texture, tuple(img.data_extent[1:4:2])
+    texture = tvtk.Texture(interpolate=0)
+    texture.set_input_data(data)
+    return texture, tuple(data.extent[1:4:2])
+
+
+def _image_data(array):
+    """Create a tvtk.ImageData from an array of pixels."""
+    from tvtk.api import tvtk
+
+    array = np.asarray(array)
+    if array.ndim == 2:
+        array = array[..., np.newaxis]
+    if array.ndim != 3 or array.shape[2] not in [1, 2, 3, 4]:
+        raise ValueError(
+            "The image array has an unsupported shape: " + str(array.shape)
+        )
+    if np.issubdtype(array.dtype, np.floating):
+        array = np.round(np.clip(array, 0, 1) * 255)
+    height, width, comp = array.shape
+    # vtk images start with the bottom row
+    pixels = array[::-1].reshape(-1, comp).astype(np.uint8)
+    data = tvtk.ImageData(dimensions=(width, height, 1))
+    data.point_data.scalars = pixels
+    data.point_data.scalars.name = "pixels"
+    return data
 
 
 def mlabimg(
@@ -264,7 +215,7 @@ def mlabimg(
     ref_y_extent=None,
 ):
     """
-    Render image files in mayavi. Analogous to mlab.text3d.
+    Render images in mayavi. Analogous to mlab.text3d.
 
     Parameters
     ----------
@@ -274,10 +225,9 @@ def mlabimg(
         y position of the text.
     z : float
         z position of the text.
-    path : string
-        Path to the image file.
-    color : tuple, optional
-        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
+    path : string, bytes, file-like or numpy.ndarray
+        Path to the image file, the image data, a binary file-like object
+        with the image data or an array of pixels. See :any:`load_texture`.
     figure : Scene, optional
         Must be a Scene or None.
     name : string, optional
@@ -296,9 +246,9 @@ def mlabimg(
         Here you can specify the image type. Supported:
         'bmp', 'jpg', 'jpeg', 'png', 'pnm', 'dcm', 'tiff', 'ximg', 'dem',
         'mha', 'mhd', 'mnc'.
-        If set to ``None``, the file type is determined by its extension.
-        Default: None.
-    ref_y_extent : int, optional
+        If set to ``None``, the type is determined by the file extension
+        or by the content of image data. Default: None.
+    ref_y_extent : float, optional
         Reference vertical extent of the image to scale to.
         If set to ``None``, the image extent itself is used. Default: None
 
@@ -307,23 +257,61 @@ def mlabimg(
     surf : Surf
         Mayavi ``Surf`` class with the rendered image as texture.
     """
+    # keep the data to be able to reload the texture
+    data = _data(path)
     if typ is None:
-        typ = os.path.splitext(path)[1][1:].lower()
-    if typ not in IMREAD:
+        typ = image_type(path) if data is None else _data_type(data)
+    if typ not in IMREAD and typ != "array":
         raise ValueError("The file type is not supported: " + str(typ))
-    reader = IMREAD[typ]
+
+    def loader():
+        if data is None:
+            return load_texture(path, typ)
+        return load_texture(io.BytesIO(data), typ)
+
+    # load the image as texture
+    texture, extent = loader()
+    surf = _texture_surf(
+        x,
+        y,
+        z,
+        texture,
+        extent,
+        figure,
+        name,
+        opacity,
+        orientation,
+        scale,
+        ref_y_extent,
+    )
+    # track the label to be able to cull it and reload its texture
+    label_manager(surf.scene).add(surf, loader)
+
+    return surf
+
+
+def _texture_surf(
+    x,
+    y,
+    z,
+    texture,
+    extent,
+    figure=None,
+    name=None,
+    opacity=1.0,
+    orientation=(0.0, 0.0, 0.0),
+    scale=1.0,
+    ref_y_extent=None,
+):
+    """Create a surface showing the given texture. See :any:`mlabimg`."""
+    from mayavi import mlab
+
     kwargs = {}
     if figure is not None:
         kwargs["figure"] = figure
     if name is not None:
         kwargs["name"] = name
-    # load the image
-    img = reader()
-    img.file_name = path
-    img.update()
-    dim_x, dim_y = img.data_extent[1:4:2]
-    # create the texture from the image
-    texture = tvtk.Texture(input_connection=img.output_port, interpolate=0)
+    dim_x, dim_y = extent
     # create the surface points
     if ref_y_extent is None:
         ref_y_extent = dim_y
@@ -364,6 +352,8 @@ def mlabtex(
     orientation=(0.0, 0.0, 0.0),
     scale=1.0,
     dpi=1200,
+    cache=True,
+    backend=None,
 ):
     r"""
     Render for matplotlib like text in mayavi. Analogous to mlab.text3d.
@@ -394,9 +384,17 @@ def mlabtex(
         Must be an array with shape (3,).
     scale : float, optional
         The scale of the text, in figure units. It is rescaled by the size of
-        the letter "I".
+        the letter "I", when rendered by the used backend.
     dpi : int, optional
         Used dpi. Default: 1200
+    cache : bool or RenderCache, optional
+        The render cache to look up and store the rendered images.
+        If set to ``True``, the default cache :any:`CACHE` is used.
+        If set to ``False``, the text is rendered in memory.
+        Default: True
+    backend : string, optional
+        The render backend: ``"native"``, ``"sympy"`` or ``"mpl"``.
+        If set to ``None``, all backends are tried. Default: None
 
     Returns
     -------
@@ -418,34 +416,256 @@ def mlabtex(
 
     infront of them.
     """
-    # create temporary file for the reference height of the letter "I"
-    reffile = TmpFile(suffix=".png")
-    render_latex(r"I", path=reffile.name, dpi=dpi)
-    ref = tvtk.PNGReader()
-    ref.file_name = reffile.name
-    ref.update()
-    # Reference heigth of the letter "I"
-    ref_y = ref.data_extent[3]
-    reffile.close()
-    # create temporary file for the png
-    pngfile = TmpFile(suffix=".png")
-    # create png file containing text with matplotlib
-    render_latex(text, path=pngfile.name, color=color, dpi=dpi)
-    # loading image with tvtk
-    surf = mlabimg(
+    if cache is True:
+        cache = CACHE
+    manager = label_manager(figure)
+
+    def loader():
+        if isinstance(cache, RenderCache):
+            pngfile = cache.render(text, color=color, dpi=dpi, backend=backend)
+            ref = cache.reference_height(text, color, dpi, backend=backend)
+            return load_texture(pngfile, "png") + (ref,)
+        # render in memory without a temporary file (if possible)
+        data, used = render_latex_data(text, color, dpi, "png", backend)
+        ref = reference_height(used, dpi)
+        return load_texture(io.BytesIO(data), "png") + (ref,)
+
+    # identical labels in a scene share their texture
+    key = (text, tuple(float(c) for c in color), int(dpi), backend)
+    texture, extent, ref = manager.textures.acquire(key, loader)
+    # Reference heigth of the letter "I" as extent (pixel count minus one)
+    ref_y = ref - 1
+    surf = _texture_surf(
         x,
         y,
         z,
-        pngfile.name,
+        texture,
+        extent,
         figure,
         name,
         opacity,
         orientation,
         scale,
-        typ="png",
-        ref_y_extent=ref_y,
+        ref_y,
     )
-    # close temp file
-    pngfile.close()
+    # textures of uncached labels would need to be rendered again
+    if not isinstance(cache, RenderCache):
+        loader = None
+    manager.add(surf, loader, key)
 
     return surf
+
+
+class TextureSequence(object):
+    """
+    A sequence of rendered texts shown on a single surface.
+
+    Attributes
+    ----------
+    surf : Surf
+        Mayavi ``Surf`` class showing the current frame.
+    textures : list
+        The textures of all frames.
+    frame : int
+        The index of the current frame.
+    """
+
+    def __init__(self, surf, textures, sizes):
+        """
+        A sequence of rendered texts shown on a single surface.
+
+        Parameter
+        ---------
+        surf : Surf
+            Mayavi ``Surf`` class of a unit square, that is scaled to the
+            size of the shown frame.
+        textures : list
+            The textures of all frames.
+        sizes : list
+            The sizes (x, y) of all frames in figure units.
+        """
+        self.surf = surf
+        self.textures = textures
+        self.frame = 0
+        self._sizes = np.asarray(sizes, dtype=float)
+
+    def __len__(self):
+        return len(self.textures)
+
+    def set_frame(self, frame):
+        """
+        Show the given frame.
+
+        Parameters
+        ----------
+        frame : int
+            The index of the frame to show. It wraps around the end,
+            so animations can simply count up.
+        """
+        frame = frame % len(self)
+        actor = self.surf.actor.actor
+        actor.texture = self.textures[frame]
+        # the surface is a unit square
+        sx, sy = self._sizes[frame]
+        actor.scale = (sx, sy, 1.0)
+        self.frame = frame
+
+
+def mlabtex_sequence(
+    x,
+    y,
+    z,
+    texts,
+    color=(0, 0, 0),
+    figure=None,
+    name=None,
+    opacity=1.0,
+    orientation=(0.0, 0.0, 0.0),
+    scale=1.0,
+    dpi=1200,
+    cache=True,
+    backend=None,
+    processes=None,
+):
+    r"""
+    Render a sequence of texts as frames of one label in mayavi.
+
+    All texts are rendered in parallel up front, so switching between them
+    is instant. This is meant for animated labels like time stamps.
+
+    Parameters
+    ----------
+    x : float
+        x position of the text.
+    y : float
+        y position of the text.
+    z : float
+        z position of the text.
+    texts : iterable of string
+        The texts of all frames.
+    color : tuple, optional
+        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
+    figure : Scene, optional
+        Must be a Scene or None.
+    name : string, optional
+        the name of the vtk object created.
+    opacity : float, optional
+        The overall opacity of the vtk object. Must be a float. Default: 1.0
+    orientation : tuple, optional
+        the angles giving the orientation of the text.
+        If the text is oriented to the camera,
+        these angles are referenced to the axis of the camera.
+        If not, these angles are referenced to the z axis.
+        Must be an array with shape (3,).
+    scale : float, optional
+        The scale of the text, in figure units. It is rescaled by the size of
+        the letter "I", when rendered by the used backend.
+    dpi : int, optional
+        Used dpi. Default: 1200
+    cache : bool or RenderCache, optional
+        The render cache to look up and store the rendered images.
+        If set to ``True``, the default cache :any:`CACHE` is used.
+        If set to ``False``, a temporary cache is used. Default: True
+    backend : string, optional
+        The render backend: ``"native"``, ``"sympy"`` or ``"mpl"``.
+        If set to ``None``, all backends are tried. Default: None
+    processes : int, optional
+        Number of worker processes for rendering. If set to ``None``,
+        at most the number of CPUs is used and a single missing text is
+        rendered in the current process. Default: None
+
+    Returns
+    -------
+    sequence : TextureSequence
+        The sequence showing the first text. Use ``set_frame`` to switch.
+
+    Notes
+    -----
+    Texts, that are not cached yet, are rendered with worker processes.
+    Where processes are spawned (the default on Windows and macOS),
+    the script needs an ``if __name__ == "__main__":`` guard.
+
+    Examples
+    --------
+    >>> texts = ["t = {}".format(i) for i in range(100)]
+    >>> seq = mlabtex_sequence(0, 0, 0, texts)
+    >>> @mlab.animate
+    ... def anim():
+    ...     for i in range(len(seq)):
+    ...         seq.set_frame(i)
+    ...         yield
+    """
+    texts = list(texts)
+    if not texts:
+        raise ValueError("Mlabtex: at least one text is needed.")
+    if cache is True:
+        cache = CACHE
+    tmp_dir = None
+    if not isinstance(cache, RenderCache):
+        tmp_dir = tempfile.mkdtemp()
+        cache = RenderCache(tmp_dir)
+    try:
+        records = [
+            {
+                "text": text,
+                "path": None,
+                "color": color,
+                "dpi": dpi,
+                "output": "png",
+                "backend": backend,
+            }
+            for text in texts
+        ]
+        processes = _pool_size(cache, records, processes)
+        errors = [
+            "{}: {}".format(texts[index], error)
+            for index, status, error in render_many(records, cache, processes)
+            if status == "failed"
+        ]
+        if errors:
+            raise RenderError(
+                "Mlabtex: Could not render the latex-code..."
+                + os.linesep
+                + os.linesep.join(errors)
+                + os.linesep
+            )
+        textures, sizes = [], []
+        for text in texts:
+            # already rendered, but recorded in the cache history
+            pngfile = cache.render(text, color=color, dpi=dpi, backend=backend)
+            ref = cache.reference_height(text, color, dpi, backend=backend)
+            texture, extent = load_texture(pngfile, "png")
+            # extent scaled by the reference heigth of the letter "I"
+            ref_y = ref - 1
+            textures.append(texture)
+            sizes.append(np.asarray(extent, dtype=float) * scale / ref_y)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    # a unit square scaled to the size of each frame
+    surf = _texture_surf(
+        x, y, z, textures[0], (1, 1), figure, name, opacity, orientation
+    )
+    sequence = TextureSequence(surf, textures, sizes)
+    sequence.set_frame(0)
+    # culled labels reload the texture of the current frame
+    label_manager(surf.scene).add(
+        surf, lambda: (sequence.textures[sequence.frame],)
+    )
+    return sequence
+
+
+def _pool_size(cache, records, processes=None):
+    """
+    Number of worker processes to render the records missing in the cache.
+
+    If ``processes`` is given, it is used as is.
+    A single missing record is rendered in the current process.
+    """
+    if processes is not None:
+        return processes
+    missing = 0
+    for rec in records:
+        params = [rec[k] for k in ["text", "color", "dpi", "output"]]
+        missing += not cache.contains(*params, backend=rec["backend"])
+    return max(1, min(multiprocessing.cpu_count(), missing))
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""mlabtex: View dependent culling of labels in mayavi."""
+from __future__ import absolute_import, division, print_function
+
+import time
+import weakref
+import numpy as np
+
+from mlabtex.textures import TextureRegistry
+
+# label managers of all scenes
+_MANAGERS = weakref.WeakKeyDictionary()
+
+
+def culled(bounds, matrix, size, min_size=1.0):
+    """
+    Whether bounding boxes are off-screen or smaller than the given size.
+
+    Only the sides of the view are checked, not its depth.
+
+    Parameters
+    ----------
+    bounds : array_like
+        The bounding boxes ``(xmin, xmax, ymin, ymax, zmin, zmax)``
+        with shape (6,) or (n, 6).
+    matrix : numpy.ndarray
+        The composite projection matrix of the camera with shape (4, 4).
+    size : tuple
+        The size of the viewport in pixels.
+    min_size : float, optional
+        The minimal projected extent in pixels. Default: 1.0
+
+    Returns
+    -------
+    culled : bool or numpy.ndarray
+        True if the box is outside of the view frustum or too small.
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    box = bounds.reshape(-1, 3, 2)
+    # all 8 corners of the boxes in homogeneous coordinates
+    corners = np.ones((len(box), 8, 4))
+    for i, (ix, iy, iz) in enumerate(np.ndindex(2, 2, 2)):
+        corners[:, i, 0] = box[:, 0, ix]
+        corners[:, i, 1] = box[:, 1, iy]
+        corners[:, i, 2] = box[:, 2, iz]
+    clip = corners.dot(np.transpose(matrix))
+    w = clip[..., 3]
+    # all corners outside of one side of the view or behind the camera;
+    # the near and far planes are ignored, since vtk only fits them to the
+    # visible actors, so culled labels would never show up again
+    outside = np.all(w <= 0, axis=1)
+    for i in range(2):
+        outside |= np.all(clip[..., i] < -w, axis=1)
+        outside |= np.all(clip[..., i] > w, axis=1)
+    # the projected size is only meaningful in front of the camera
+    front = np.all(w > 0, axis=1)
+    ndc = clip[front, :, :2] / w[front, :, np.newaxis]
+    extent = np.ptp(ndc, axis=1) * np.asarray(size) / 2.0
+    small = np.zeros(len(box), dtype=bool)
+    small[front] = np.max(extent, axis=1) < min_size
+    result = outside | small
+    return result[0] if bounds.ndim == 1 else result
+
+
+class _Label(object):
+    """A label tracked by the label manager."""
+
+    def __init__(self, surf, loader=None, key=None):
+        self.surf = weakref.ref(surf)
+        self.loader = loader
+        self.key = key
+        self.held = key is not None
+        self.culled = False
+        self.hidden_since = None
+
+
+class LabelManager(object):
+    """
+    Manager for all labels of a scene created by mlabtex and mlabimg.
+
+    When enabled, labels outside of the view frustum or smaller than
+    ``min_size`` pixels are hidden before each render of the scene.
+
+    Attributes
+    ----------
+    textures : TextureRegistry
+        Textures shared by identical labels of the scene.
+    min_size : float
+        Minimal projected extent of a label in pixels to be shown.
+    release_after : float or None
+        Time in seconds after which textures of hidden labels are released.
+        They are reloaded as soon as the label is visible again.
+        If ``None``, textures are never released.
+    """
+
+    def __init__(self, scene, min_size=1.0, release_after=None):
+        """
+        Manager for all labels of a scene.
+
+        Parameter
+        ---------
+        scene : TVTKScene
+            The tvtk scene of the labels.
+        min_size : float, optional
+            Minimal projected extent of a label in pixels. Default: 1.0
+        release_after : float or None, optional
+            Time in seconds after which textures of hidden labels are
+            released. Default: None
+        """
+        self.min_size = min_size
+        self.release_after = release_after
+        self.textures = TextureRegistry()
+        self._scene = weakref.ref(scene)
+        self._labels = []
+        self._observer = None
+        self._view = None
+
+    @property
+    def labels(self):
+        """list: All tracked labels, that are still alive."""
+        for label in self._labels:
+            if label.surf() is None:
+                self._release(label)
+        self._labels = [lab for lab in self._labels if lab.surf() is not None]
+        return [lab.surf() for lab in self._labels]
+
+    @property
+    def enabled(self):
+        """bool: Whether culling is enabled."""
+        return self._observer is not None
+
+    def add(self, surf, loader=None, key=None):
+        """
+        Track a label.
+
+        Parameters
+        ----------
+        surf : Surf
+            Mayavi ``Surf`` class of the label.
+        loader : callable, optional
+            Function returning a new texture for the label and the extent
+            of its image, like :any:`load_texture`.
+            Needed to release the texture of hidden labels. Default: None
+        key : hashable, optional
+            Key of the shared texture in :any:`textures` used by the label.
+            The label holds one reference to it, that is released
+            when the label is removed from the scene. Default: None
+        """
+        self.remove(surf)
+        self._labels.append(_Label(surf, loader, key))
+        surf.on_trait_change(self._stopped, "running")
+        self._view = None
+
+    def remove(self, surf):
+        """Stop tracking a label and show it again, if it was culled."""
+        for label in list(self._labels):
+            if label.surf() is surf:
+                # labels removed from the scene don't need their texture
+                self._show(label, surf, reload=surf.running)
+                self._release(label)
+                surf.on_trait_change(self._stopped, "running", remove=True)
+                self._labels.remove(label)
+
+    def enable(self):
+        """Enable culling before each render of the scene."""
+        if not self.enabled:
+            renderer = self._scene().renderer
+            self._observer = renderer.add_observer("StartEvent", self._render)
+            self._view = None
+
+    def disable(self):
+        """Disable culling and show all culled labels again."""
+        if self.enabled:
+            self._scene().renderer.remove_observer(self._observer)
+            self._observer = None
+        for label in self._labels:
+            surf = label.surf()
+            if surf is not None:
+                self._show(label, surf)
+
+    def update(self, force=False):
+        """
+        Update the visibility of all labels for the current view.
+
+        This is called before each render, when culling is enabled.
+        The labels are only checked again, if the camera or the size of the
+        viewport changed. Use ``force`` after moving labels.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Update the labels, even if the view didn't change.
+            Default: False
+        """
+        renderer = self._scene().renderer
+        size = tuple(renderer.size)
+        if min(size) <= 0:
+            return
+        camera = renderer.active_camera
+        matrix = camera.get_composite_projection_transform_matrix(
+            size[0] / size[1], -1, 1
+        )
+        matrix = np.array(
+            [[matrix.get_element(i, j) for j in range(4)] for i in range(4)]
+        )
+        view = (size, tuple(matrix.ravel()))
+        now = time.time()
+        surfs = self.labels
+        if (force or view != self._view) and surfs:
+            self._view = view
+            bounds = [surf.actor.actor.bounds for surf in surfs]
+            hide = culled(bounds, matrix, size, self.min_size)
+            for label, surf, cull in zip(self._labels, surfs, hide):
+                if not cull:
+                    self._show(label, surf)
+                elif not label.culled and surf.visible:
+                    label.culled = True
+                    label.hidden_since = now
+                    surf.actor.actor.visibility = False
+        if self.release_after is None:
+            return
+        for label in self._labels:
+            surf = label.surf()
+            if (
+                surf is not None
+                and label.culled
+                and label.loader is not None
+                and surf.actor.actor.texture is not None
+                and now - label.hidden_since > self.release_after
+            ):
+                surf.actor.actor.texture = None
+                self._release(label)
+
+    def _render(self, obj=None, event=None):
+        """Observer for the start of a render."""
+        self.update()
+
+    def _stopped(self, obj, name, new):
+        """Observer for the removal of a label from the scene."""
+        if not new:
+            self.remove(obj)
+
+    def _release(self, label):
+        """Release the shared texture of a label."""
+        if label.held:
+            self.textures.release(label.key)
+            label.held = False
+
+    def _show(self, label, surf, reload=True):
+        """Show a culled label again."""
+        if not label.culled:
+            return
+        label.culled = False
+        label.hidden_since = None
+        actor = surf.actor.actor
+        if reload and actor.texture is None and label.loader is not None:
+            if label.key is None:
+                actor.texture = label.loader()[0]
+            else:
+                actor.texture = self.textures.acquire(
+                    label.key, label.loader
+                )[0]
+                label.held = True
+        actor.visibility = surf.visible
+
+
+def label_manager(figure=None):
+    """
+    Get the label manager of a figure.
+
+    Parameters
+    ----------
+    figure : Scene, optional
+        Must be a Scene or None. If None, the current figure is used.
+
+    Returns
+    -------
+    manager : LabelManager
+        The label manager of the figure.
+
+    Examples
+    --------
+    Hide all labels, that are off-screen or smaller than 2 pixels and
+    release their textures after 10 seconds:
+
+    >>> manager = label_manager()
+    >>> manager.min_size = 2.0
+    >>> manager.release_after = 10.0
+    >>> manager.enable()
+    """
+    if figure is None:
+        from mayavi import mlab
+
+        figure = mlab.gcf()
+    scene = getattr(figure, "scene", figure)
+    if scene not in _MANAGERS:
+        _MANAGERS[scene] = LabelManager(scene)
+    return _MANAGERS[scene]
@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""mlabtex: Renderers for latex code producing image files."""
+from __future__ import absolute_import, division, print_function
+
+import os
+import codecs
+import shutil
+import struct
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from multiprocessing.util import Finalize
+
+try:
+    from shutil import which as find_executable
+except ImportError:  # python 2
+    from distutils.spawn import find_executable
+
+
+class RenderError(Exception):
+    """Render error."""
+
+    pass
+
+
+class TmpFile(object):
+    """
+    A closed temporary file class.
+
+    Attributes
+    ----------
+    name : string
+        Name and path to the file.
+    file : class
+        Temporary file handler
+    """
+
+    def __init__(self, suffix="txt"):
+        """
+        A closed temporary file.
+
+        Parameter
+        ---------
+        suffix : string, optional
+            The suffix for the temporary file. Default: "txt"
+        """
+        self.file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+        self.file.close()
+
+    @property
+    def name(self):
+        """File name."""
+        return self.file.name
+
+    def close(self):
+        """Unlink the file."""
+        os.unlink(self.name)
+
+
+def _latex_preamble(color):
+    r"""Latex preamble for the given text color up to ``\begin{document}``."""
+    return (
+        r"\documentclass[12pt]{article}"
+        + os.linesep
+        + r"\pagestyle{empty}"
+        + os.linesep
+        + r"\usepackage[utf8]{inputenc}"
+        + os.linesep
+        + r"\usepackage{amsmath}"
+        + os.linesep
+        + r"\usepackage{amssymb}"
+        + os.linesep
+        + r"\usepackage{amsfonts}"
+        + os.linesep
+        + r"\usepackage{helvet}"
+        + os.linesep
+        + r"\renewcommand{\familydefault}{\sfdefault}"
+        + os.linesep
+        + r"\usepackage{xcolor}"
+        + os.linesep
+        + r"\definecolor{user}{rgb}"
+        + "{"
+        + "{}, {}, {}".format(*color)
+        + "}"
+        + os.linesep
+        + r"\color{user}"
+        + os.linesep
+        + r"\everymath{\displaystyle}"
+        + os.linesep
+        + r"\begin{document}"
+    )
+
+
+def render_latex_mpl(text, path, color=(0, 0, 0), dpi=600, output="png"):
+    r"""
+    Render a LaTeX-formula into an image with matplotlib.
+
+    Parameters
+    ----------
+    text : string
+        String containing the latex-code.
+    path : string
+        Path to the file to be saved.
+    color : tuple, optional
+        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
+    dpi : int, optional
+        Used dpi. Default: 1200
+    output : string, optional
+        Output format. Default: ``"png"``
+
+    Notes
+    -----
+    If you get the following error:
+
+        ``RuntimeError: libpng signaled error``
+
+    Try to set the dpi higher. (1200 recomended)
+
+    If big symbols like ``\int`` or ``\sum`` don't show up properly,
+    try setting a
+
+        ``\displaystyle``
+
+    infront of them.
+    """
+    from matplotlib.mathtext import MathTextParser
+    from matplotlib.font_manager import FontProperties
+    from matplotlib import figure, rc
+
+    # backend_agg supports all of the core output formats
+    from matplotlib.backends import backend_agg
+
+    rc("text", usetex=False)
+    prop = FontProperties()
+    parser = MathTextParser("path")
+    width, height, depth, _, _ = parser.parse(text, dpi=72, prop=prop)
+    fig = figure.Figure(figsize=(width / 72.0, height / 72.0))
+    fig.text(0, depth / height, text, fontproperties=prop, color=color)
+    backend_agg.FigureCanvasAgg(fig)
+    fig.savefig(path, dpi=dpi, format=output, transparent=True)
+
+
+def render_latex_sympy(text, path, color=(0, 0, 0), dpi=600, output="png"):
+    r"""
+    Renders LaTeX-formula into an image with sympy.
+
+    Parameters
+    ----------
+    text : string
+        String containing the latex-code.
+    path : string
+        Path to the file to be saved.
+    color : tuple, optional
+        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
+    dpi : int, optional
+        Used dpi. Default: 1200
+    output : string, optional
+        Output format. Default: ``"png"``
+
+    Notes
+    -----
+    If you get the following error:
+
+        ``RuntimeError: libpng signaled error``
+
+    Try to set the dpi higher. (1200 recomended)
+
+    If big symbols like ``\int`` or ``\sum`` don't show up properly,
+    try setting a
+
+        ``\displaystyle``
+
+    infront of them.
+    """
+    from sympy import preview
+
+    preamble = _latex_preamble(color)
+    preview(
+        text,
+        viewer="file",
+        output=output,
+        filename=path,
+        preamble=preamble,
+        euler=False,
+        dvioptions=_dvipng_options(dpi),
+    )
+
+
+class _LatexWorkdir(object):
+    """
+    A persistent working directory for latex of the current process.
+
+    It is placed in memory (``/dev/shm``) if possible and
+    removed on exit of the process. Use it as context manager to get
+    the path with exclusive access.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        """Forget the directory and the lock of the parent process."""
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.path = None
+
+    def __enter__(self):
+        # forked processes inherit the directory and maybe a held lock
+        if self.pid != os.getpid():
+            self._reset()
+        self.lock.acquire()
+        try:
+            return self.get()
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def __exit__(self, *args):
+        self.lock.release()
+
+    def get(self):
+        """Path to the working directory. Created on first call."""
+        if self.pid != os.getpid():
+            self._reset()
+        if self.path is None or not os.path.isdir(self.path):
+            shm = "/dev/shm"
+            shm_ok = os.path.isdir(shm) and os.access(shm, os.W_OK)
+            self.path = tempfile.mkdtemp(
+                prefix="mlabtex_", dir=shm if shm_ok else None
+            )
+            # worker processes don't call atexit, but finalizers
+            Finalize(
+                self, shutil.rmtree, args=(self.path, True), exitpriority=0
+            )
+        return self.path
+
+
+_WORKDIR = _LatexWorkdir()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_WORKDIR._reset)
+
+
+def render_latex_native(
+    text, path=None, color=(0, 0, 0), dpi=600, output="png"
+):
+    r"""
+    Renders LaTeX-formula into an image with latex and dvipng directly.
+
+    The latex source is written to a persistent working directory,
+    that is kept in memory (``/dev/shm``) if available.
+    The image is returned as data and only written to a file if requested.
+
+    Parameters
+    ----------
+    text : string
+        String containing the latex-code.
+    path : string, optional
+        Path to the file to be saved. If set to ``None``, no file is
+        written. Default: None
+    color : tuple, optional
+        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
+    dpi : int, optional
+        Used dpi. Default: 600
+    output : string, optional
+        Output format. Only ``"png"`` is supported. Default: ``"png"``
+
+    Returns
+    -------
+    data : bytes
+        The image data.
+
+    Notes
+    -----
+    The result is identical to :any:`render_latex_sympy`,
+    but without the overhead of a new temporary directory for each text.
+
+    If big symbols like ``\int`` or ``\sum`` don't show up properly,
+    try setting a
+
+        ``\displaystyle``
+
+    infront of them.
+    """
+    if output != "png":
+        raise ValueError("Mlabtex: native backend only supports png output")
+    for program in ["latex", "dvipng"]:
+        if find_executable(program) is None:
+            raise RuntimeError(program + " program is not installed")
+    source = (
+        _latex_preamble(color)
+        + os.linesep
+        + text
+        + os.linesep
+        + os.linesep
+        + r"\end{document}"
+    )
+    with _WORKDIR as workdir:
+        # latex writes no dvi file for empty pages, so remove the old ones
+        for ext in [".dvi", ".aux", ".png"]:
+            if os.path.exists(os.path.join(workdir, "label" + ext)):
+                os.unlink(os.path.join(workdir, "label" + ext))
+        tex = os.path.join(workdir, "label.tex")
+        with codecs.open(tex, "w", "utf-8") as fil:
+            fil.write(source)
+        png = os.path.join(workdir, "label.png")
+        latex = ["latex", "-halt-on-error", "-interaction=nonstopmode"]
+        _run(latex + ["label.tex"], workdir)
+        dvipng = ["dvipng"] + _dvipng_options(dpi)
+        _run(dvipng + ["-o", "label.png", "label.dvi"], workdir)
+        with open(png, "rb") as fil:
+            data = fil.read()
+    if path is not None:
+        with open(path, "wb") as fil:
+            fil.write(data)
+    return data
+
+
+def _run(command, cwd):
+    """Run a command and raise an error with its output if it fails."""
+    proc = subprocess.Popen(
+        command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    out = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise RuntimeError(
+            "'{}' exited abnormally with the following output:{}{}".format(
+                command[0], os.linesep, out.decode("utf-8", "replace")
+            )
+        )
+
+
+def _dvipng_options(dpi):
+    """Options for dvipng to create tight images with transparency."""
+    return [
+        "-T",
+        "tight",
+        "-z",
+        "0",
+        "--truecolor",
+        "-D",
+        str(int(dpi)),
+        "-bg",
+        "Transparent",
+    ]
+
+
+def render_latex(
+    text, path, color=(0, 0, 0), dpi=600, output="png", backend=None
+):
+    r"""
+    Renders LaTeX-formula into an image.
+
+    Parameters
+    ----------
+    text : string
+        String containing the latex-code.
+    path : string
+        Path to the file to be saved.
+    color : tuple, optional
+        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
+    dpi : int, optional
+        Used dpi. Default: 1200
+    output : string, optional
+        Output format. Default: ``"png"``
+    backend : string, optional
+        The backend to use: ``"native"``, ``"sympy"`` or ``"mpl"``.
+        If set to ``None``, all :any:`BACKENDS` are tried. Default: None
+
+    Returns
+    -------
+    backend : string
+        The backend that rendered the text.
+
+    Notes
+    -----
+    If you get the following error:
+
+        ``RuntimeError: libpng signaled error``
+
+    Try to set the dpi higher. (1200 recomended)
+
+    If big symbols like ``\int`` or ``\sum`` don't show up properly,
+    try setting a
+
+        ``\displaystyle``
+
+    infront of them.
+
+    It will try to render it with latex directly first, then with sympy.
+    If that fails it will use matplotlib.
+    """
+    return _render(text, path, color, dpi, output, backend)[0]
+
+
+def render_latex_data(
+    text, color=(0, 0, 0), dpi=600, output="png", backend=None
+):
+    """
+    Renders LaTeX-formula into image data in memory.
+
+    Parameters
+    ----------
+    text : string
+        String containing the latex-code.
+    color : tuple, optional
+        color of the text given as rgb tuple. Default: ``(0, 0, 0)``
+    dpi : int, optional
+        Used dpi. Default: 600
+    output : string, optional
+        Output format. Default: ``"png"``
+    backend : string, optional
+        The backend to use: ``"native"``, ``"sympy"`` or ``"mpl"``.
+        If set to ``None``, all :any:`BACKENDS` are tried. Default: None
+
+    Returns
+    -------
+    data : bytes
+        The image data.
+    backend : string
+        The backend that rendered the text.
+
+    Notes
+    -----
+    Only the native backend renders without a temporary image file.
+    """
+    backend, data = _render(text, None, color, dpi, output, backend)
+    return data, backend
+
+
+def _render(text, path, color, dpi, output, backend):
+    """
+    Render with the given or all backends.
+
+    Returns the name of the used backend and the image data,
+    which is only read if ``path`` is None.
+    """
+    if backend is None:
+        backends = list(BACKENDS)
+    elif backend in BACKENDS:
+        backends = [backend]
+    else:
+        raise ValueError("Mlabtex: unknown backend: " + str(backend))
+    errors = []
+    for name in backends:
+        try:
+            if name == "native":
+                data = render_latex_native(text, path, color, dpi, output)
+            elif path is None:
+                tmp = TmpFile(suffix="." + output)
+                try:
+                    BACKENDS[name](text, tmp.name, color, dpi, output)
+                    with open(tmp.name, "rb") as fil:
+                        data = fil.read()
+                finally:
+                    tmp.close()
+            else:
+                BACKENDS[name](text, path, color, dpi, output)
+                data = None
+        except Exception as exc:
+            errors.append(str(exc))
+        else:
+            return name, data
+    raise RenderError(
+        "Mlabtex: Could not render the latex-code..."
+        + os.linesep
+        + os.linesep.join(errors)
+        + os.linesep
+    )
+
+
+def reference_height(backend, dpi=600):
+    """
+    Height of the letter "I" in pixels, when rendered by the given backend.
+
+    It is used as reference to scale rendered texts.
+    For matplotlib, it is calculated from the font metrics.
+    For latex, the letter is rendered once per dpi with the native backend,
+    since the rasterized height depends on the installed fonts.
+    Without latex, the cap-height of helvetica is used.
+    :any:`RenderCache` stores the height with each image,
+    so images imported from a bundle don't depend on this.
+
+    Parameters
+    ----------
+    backend : string
+        The backend used for rendering. See :any:`BACKENDS`.
+    dpi : int, optional
+        Used dpi. Default: 600
+
+    Returns
+    -------
+    height : float
+        Height of the letter "I" in pixels.
+    """
+    if backend == "mpl":
+        if "mpl" not in _REF_HEIGHT:
+            from matplotlib.mathtext import MathTextParser
+            from matplotlib.font_manager import FontProperties
+
+            parser = MathTextParser("path")
+            # the height of the layout box determines the image height
+            _REF_HEIGHT["mpl"] = parser.parse(
+                "I", dpi=72, prop=FontProperties()
+            )[1]
+        return _REF_HEIGHT["mpl"] * dpi / 72.0
+    if backend in ["native", "sympy"]:
+        # sympy uses the same preamble and dvipng options
+        key = ("latex", int(dpi))
+        if key not in _REF_HEIGHT:
+            try:
+                data = render_latex_native("I", dpi=dpi)
+            except Exception:
+                # the image is cropped to the glyph: the cap-height of
+                # helvetica at the 12pt document font size (72.27pt per inch)
+                height = HELVETICA_CAP_HEIGHT * 12.0 * dpi / 72.27
+            else:
+                # the image height is stored in the IHDR chunk of the png
+                height = float(struct.unpack(">I", data[20:24])[0])
+            _REF_HEIGHT[key] = height
+        return _REF_HEIGHT[key]
+    raise ValueError("Mlabtex: unknown backend: " + str(backend))
+
+
+BACKENDS = OrderedDict(
+    [
+        ("native", render_latex_native),
+        ("sympy", render_latex_sympy),
+        ("mpl", render_latex_mpl),
+    ]
+)
+"""dict: All render backends in the order they are tried."""
+
+HELVETICA_CAP_HEIGHT = 0.718
+"""float: Cap-height of the helvetica font used by latex in em."""
+
+# reference heights of the backends, that depend on the fonts
+# (matplotlib at 72 dpi, latex for each dpi)
+_REF_HEIGHT = {}
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""mlabtex: Shared textures of identical labels in a scene."""
+from __future__ import absolute_import, division, print_function
+
+
+class TextureRegistry(object):
+    """
+    Reference counted textures of a scene keyed on their render parameters.
+
+    Identical labels share one texture and its image, which is released
+    when no label is using it anymore.
+    """
+
+    def __init__(self):
+        """Reference counted textures of a scene."""
+        self._entries = {}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def count(self, key):
+        """Number of references to the texture of the given key."""
+        return self._entries[key][1] if key in self._entries else 0
+
+    def acquire(self, key, loader):
+        """
+        Get a reference to a shared texture.
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the texture, e.g. its render parameters.
+        loader : callable
+            Function returning a tuple with the texture as first entry,
+            followed by further information like the extent of its image.
+            Only called, if the texture is not present yet.
+
+        Returns
+        -------
+        loaded : tuple
+            The shared result of the loader.
+        """
+        if key not in self._entries:
+            self._entries[key] = [tuple(loader()), 0]
+        entry = self._entries[key]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, key):
+        """
+        Release a reference to a shared texture.
+
+        The texture is removed from the registry with its last reference.
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the texture.
+        """
+        entry = self._entries[key]
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._entries[key]
@@ -79,4 +79,5 @@ setup(
         "all": ["sympy", "matplotlib"],  # everything
     },
     packages=find_packages(exclude=["tests*", "docs*"]),
+    entry_points={"console_scripts": ["mlabtex = mlabtex.cli:main"]},
 )
@@ -4,17 +4,293 @@ This is the unittest for mlabtex.
 """
 from __future__ import division, absolute_import, print_function
 
+import io
+import os
+import json
+import shutil
+import tempfile
 import unittest
-from mlabtex import __version__
+import multiprocessing
+import numpy as np
+from mlabtex import __version__, RenderCache
+from mlabtex.cli import main, read_manifest
+from mlabtex.labels import LabelManager, culled
+from mlabtex import render
+from mlabtex.render import reference_height
+from mlabtex.textures import TextureRegistry
+from mlabtex.core import TextureSequence, _pool_size, image_type
+
+
+def _workdir(_):
+    """Working directory of the native backend in a worker process."""
+    with render._WORKDIR as workdir:
+        return os.getpid(), workdir
+
+
+class _Stub(object):
+    """Stub for mayavi and tvtk objects with the given attributes."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
 
 
 class Test(unittest.TestCase):
     def setUp(self):
         self.version = __version__
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
 
     def test_mlabtex(self):
         print(self.version)
 
+    def test_cache(self):
+        cache = RenderCache(os.path.join(self.dir, "cache"))
+        key = cache.key("$x$", (0, 0, 0), 600, "png")
+        self.assertEqual(key, cache.key("$x$", (0.0, 0.0, 0.0), 600.0))
+        self.assertNotEqual(key, cache.key("$x$", (1, 0, 0), 600, "png"))
+        self.assertFalse(cache.contains("$x$"))
+        # cached images are copied without rendering
+        os.makedirs(cache.directory)
+        with open(cache.file("$x$"), "wb") as fil:
+            fil.write(b"image")
+        path = os.path.join(self.dir, "x.png")
+        self.assertEqual(cache.render("$x$", path), cache.file("$x$"))
+        with open(path, "rb") as fil:
+            self.assertEqual(fil.read(), b"image")
+
+    def test_manifest(self):
+        lines = [
+            '{"text": "$x$", "path": "x.jpg", "color": [1, 0, 0]}',
+            "",
+            '{"text": "$y$"}',
+            "no json",
+            '{"text": "$z$", "color": "red"}',
+            "[1, 2]",
+        ]
+        result = list(read_manifest(lines))
+        self.assertEqual([res[0] for res in result], [1, 3, 4, 5, 6])
+        self.assertEqual(result[0][1]["output"], "jpg")
+        self.assertEqual(result[0][1]["color"], (1, 0, 0))
+        self.assertEqual(result[0][1]["dpi"], 600)
+        # records without path only fill the cache
+        self.assertIsNone(result[1][1]["path"])
+        self.assertEqual(result[1][1]["output"], "png")
+        self.assertIsNone(result[2][1])
+        # colors are checked when reading, so they are reported as failed
+        self.assertIsNone(result[3][1])
+        self.assertIsNone(result[4][1])
+
+    def test_render_cli(self):
+        manifest = os.path.join(self.dir, "manifest.jsonl")
+        report = os.path.join(self.dir, "report.jsonl")
+        with open(manifest, "w") as fil:
+            for name in ["x", "y", "z"]:
+                record = {
+                    "text": "${}$".format(name),
+                    "path": os.path.join(self.dir, name + ".png"),
+                    "dpi": 100,
+                    "backend": "mpl",
+                }
+                fil.write(json.dumps(record) + "\n")
+        args = ["render", manifest, "-q", "-j", "2", "-r", report]
+        args += ["--cache-dir", os.path.join(self.dir, "cache")]
+        for status in ["rendered", "cached"]:
+            self.assertEqual(main(args), 0)
+            with open(report, "r") as fil:
+                results = [json.loads(line) for line in fil]
+            self.assertEqual(sorted(res["line"] for res in results), [1, 2, 3])
+            self.assertEqual([res["status"] for res in results], [status] * 3)
+        for name in ["x", "y", "z"]:
+            path = os.path.join(self.dir, name + ".png")
+            self.assertTrue(os.path.isfile(path))
+
+    def test_bundle(self):
+        cache = RenderCache(os.path.join(self.dir, "cache"))
+        cache.render("$x$", dpi=100, backend="mpl")
+        cache.render("$y$", dpi=100, backend="mpl")
+        manifest = os.path.join(self.dir, "history.jsonl")
+        cache.save_history(manifest)
+        # prewarm a fresh cache with the history of the last run
+        other = RenderCache(os.path.join(self.dir, "other"))
+        result = other.prewarm(manifest, processes=1, background=False)
+        expected = [(0, "rendered", None), (1, "rendered", None)]
+        self.assertEqual(sorted(result), expected)
+        self.assertEqual(len(other.history), 0)
+        self.assertTrue(other.contains("$y$", dpi=100, backend="mpl"))
+        bundle = os.path.join(self.dir, "bundle.zip")
+        self.assertEqual(other.export_bundle(bundle, manifest), 2)
+        new = RenderCache(os.path.join(self.dir, "new"))
+        self.assertEqual(new.import_bundle(bundle), 2)
+        for text in ["$x$", "$y$"]:
+            info = new.info(text, dpi=100, backend="mpl")
+            self.assertEqual((info["text"], info["backend"]), (text, "mpl"))
+            ref = reference_height("mpl", 100)
+            self.assertAlmostEqual(info["reference_height"], ref)
+            with open(other.file(text, dpi=100, backend="mpl"), "rb") as fil:
+                data = fil.read()
+            with open(new.file(text, dpi=100, backend="mpl"), "rb") as fil:
+                self.assertEqual(fil.read(), data)
+
+    def test_culled(self):
+        # identity projection: visible region is the cube [-1, 1]^3
+        mat, size = np.eye(4), (100, 100)
+        self.assertFalse(culled((-0.5, 0.5, -0.5, 0.5, 0, 0), mat, size))
+        self.assertTrue(culled((2, 3, -0.5, 0.5, 0, 0), mat, size))
+        self.assertTrue(culled((0, 0.01, 0, 0.01, 0, 0), mat, size))
+        result = culled([(0, 0.01, 0, 0.01, 0, 0)] * 2, mat, size, 0.1)
+        self.assertFalse(np.any(result))
+
+    def test_label_manager(self):
+        matrix = np.eye(4)
+        camera = _Stub(
+            get_composite_projection_transform_matrix=lambda *args: _Stub(
+                get_element=lambda i, j: matrix[i, j]
+            )
+        )
+        renderer = _Stub(
+            size=(100, 100),
+            active_camera=camera,
+            add_observer=lambda event, func: 1,
+            remove_observer=lambda observer: None,
+        )
+        # a label behind the far clipping plane, that vtk only fits to
+        # the visible actors
+        actor = _Stub(bounds=(-0.5, 0.5, -0.5, 0.5, 5, 5), visibility=True)
+        actor.texture = "texture"
+        surf = _Stub(actor=_Stub(actor=actor), visible=True, running=True)
+        surf.on_trait_change = lambda *args, **kwargs: None
+        scene = _Stub(renderer=renderer)
+        manager = LabelManager(scene)
+        manager.add(surf)
+        manager.enable()
+        manager.update()
+        self.assertTrue(actor.visibility)
+        # move the view away and back again
+        matrix[0, 3] = 3.0
+        manager.update()
+        self.assertFalse(actor.visibility)
+        matrix[0, 3] = 0.0
+        manager.update()
+        self.assertTrue(actor.visibility)
+        manager.disable()
+        self.assertFalse(manager.enabled)
+
+    def test_reference_height(self):
+        calls = []
+
+        def native(text, path=None, color=(0, 0, 0), dpi=600, output="png"):
+            calls.append(dpi)
+            if dpi == 120:
+                raise RuntimeError("latex program is not installed")
+            # png signature and IHDR chunk with a height of 50 pixels
+            return b"\x89PNG\r\n\x1a\n\0\0\0\rIHDR\0\0\0\x14\0\0\0\x32"
+
+        backup = render.render_latex_native
+        render.render_latex_native = native
+        try:
+            render._REF_HEIGHT.clear()
+            # calibrated once per dpi by rendering the letter
+            self.assertEqual(reference_height("native", 600), 50)
+            self.assertEqual(reference_height("sympy", 600), 50)
+            self.assertEqual(calls, [600])
+            # font metrics without latex, that is only looked up once
+            ref = reference_height("sympy", 120)
+            self.assertAlmostEqual(ref, 0.718 * 12 * 120 / 72.27)
+            self.assertEqual(reference_height("native", 120), ref)
+            self.assertEqual(calls, [600, 120])
+            # the cache uses the height stored on the rendering host
+            cache = RenderCache(os.path.join(self.dir, "cache"))
+            os.makedirs(cache.directory)
+            info = os.path.splitext(cache.file("$x$", dpi=120))[0] + ".json"
+            with open(info, "w") as fil:
+                json.dump({"backend": "native", "reference_height": 42}, fil)
+            self.assertEqual(cache.reference_height("$x$", dpi=120), 42)
+        finally:
+            render.render_latex_native = backup
+            render._REF_HEIGHT.clear()
+        self.assertRaises(ValueError, reference_height, "none", 600)
+
+    def test_workdir(self):
+        parent = render._WORKDIR.get()
+        # workers don't share the directory or a held lock of the parent
+        with render._WORKDIR:
+            pool = multiprocessing.Pool(2)
+        try:
+            result = pool.map_async(_workdir, range(4)).get(timeout=60)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertNotIn(parent, [workdir for _, workdir in result])
+        self.assertEqual(len(set(result)), len(set(pid for pid, _ in result)))
+
+    def test_texture_sequence(self):
+        actor = _Stub(texture=None, scale=None)
+        surf = _Stub(actor=_Stub(actor=actor))
+        sizes = [(0.0, 1.0), (2.0, 1.0), (3.0, 1.5)]
+        seq = TextureSequence(surf, ["a", "b", "c"], sizes)
+        self.assertEqual(len(seq), 3)
+        seq.set_frame(1)
+        self.assertEqual((seq.frame, actor.texture), (1, "b"))
+        self.assertEqual(actor.scale, (2.0, 1.0, 1.0))
+        # frames wrap around and a first frame without width is no problem
+        seq.set_frame(5)
+        self.assertEqual((seq.frame, actor.texture), (2, "c"))
+        self.assertEqual(actor.scale, (3.0, 1.5, 1.0))
+        seq.set_frame(-3)
+        self.assertEqual((seq.frame, actor.scale), (0, (0.0, 1.0, 1.0)))
+
+    def test_pool_size(self):
+        cache = RenderCache(os.path.join(self.dir, "cache"))
+        cache.render("$x$", dpi=100, backend="mpl")
+        records = [
+            {
+                "text": text,
+                "color": (0, 0, 0),
+                "dpi": 100,
+                "output": "png",
+                "backend": "mpl",
+            }
+            for text in ["$x$", "$y$", "$z$"]
+        ]
+        # only as many workers as texts to render
+        size = min(multiprocessing.cpu_count(), 2)
+        self.assertEqual(_pool_size(cache, records), size)
+        self.assertEqual(_pool_size(cache, records[:2]), 1)
+        self.assertEqual(_pool_size(cache, records[:1]), 1)
+        self.assertEqual(_pool_size(cache, records[:1], 4), 4)
+
+    def test_texture_registry(self):
+        reg, loaded = TextureRegistry(), []
+
+        def loader():
+            loaded.append(1)
+            return "texture", (10, 5)
+
+        self.assertEqual(reg.acquire("a", loader), ("texture", (10, 5)))
+        self.assertEqual(reg.acquire("a", loader)[0], "texture")
+        self.assertEqual((len(loaded), reg.count("a")), (1, 2))
+        reg.release("a")
+        self.assertIn("a", reg)
+        reg.release("a")
+        self.assertNotIn("a", reg)
+        self.assertEqual(reg.count("a"), 0)
+
+    def test_image_type(self):
+        self.assertEqual(image_type("image.PNG"), "png")
+        self.assertEqual(image_type(b"\x89PNG\r\n"), "png")
+        self.assertEqual(image_type(b"\xff\xd8\xff"), "jpg")
+        fileobj = io.BytesIO(b"BM1234")
+        self.assertEqual(image_type(fileobj), "bmp")
+        self.assertEqual(fileobj.tell(), 0)
+        self.assertEqual(image_type(np.zeros((2, 2, 3))), "array")
+        self.assertEqual(image_type(bytearray(b"\x89PNG\r\n")), "png")
+        self.assertEqual(image_type(memoryview(b"\xff\xd8\xff")), "jpg")
+        self.assertRaises(ValueError, image_type, b"no image")
+        # text files are no paths
+        self.assertRaises(TypeError, image_type, io.StringIO(u"image.png"))
+
 
 if __name__ == "__main__":
     unittest.main()